@@ -1,5 +1,4 @@
 # app.py - RAD-TEST (mostra la location principale: quantità massima, non la somma totale)
-import re
 import streamlit as st
 import pandas as pd
 import pickle
@@ -7,6 +6,12 @@ import os
 from io import BytesIO
 import matplotlib.pyplot as plt
 import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from simulazione import (PRIORITA, ESITO_MANO, ESITO_RISERVA, ESITO_SCOPERTO, prepara_backlog, simula,
+                         valuta_ordine, reserve_inventory, applica_prelievi)
+from ingestione import COL_ITEM_CODE, COL_LOCATION, COL_QUANTITA, norma_item, try_int, get_locations_and_total, parse_stock_file, aggiungi_righe_stock, main_senza_script
 
 # ---------------- Config ----------------
 st.set_page_config(page_title="RAD-TEST", page_icon="🧪", layout="wide")
@@ -19,10 +24,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ---------------- Constants ----------------
-COL_ITEM_CODE = "Item Code"
 COL_QTA_RICHIESTA = "Requested_quantity"
-COL_LOCATION = "Location"
-COL_QUANTITA = "Quantità"
 COL_ORDER = "Order Number"
 TS_COL = "Timestamp"
 
@@ -60,65 +62,6 @@ def salva_csv(path, df):
     df.to_csv(path, index=False)
 
 # ---------------- Normalization & robust parsing ----------------
-def norma_item(x):
-    """Normalizza Item Code: gestisce int/float/str e rimuove .0 finali."""
-    if pd.isna(x):
-        return ""
-    if isinstance(x, int):
-        return str(x)
-    if isinstance(x, float):
-        if x.is_integer():
-            return str(int(x))
-        return repr(x)
-    s = str(x).strip()
-    s = s.replace('\u200b', '').strip()
-    if re.match(r'^\d+\.0+$', s):
-        s = s.split('.')[0]
-    return s.upper()
-
-def try_int(v):
-    """Parsing robusto di quantità: gestisce int/float/string con separatori."""
-    if v is None:
-        return 0
-    try:
-        if isinstance(v, int):
-            return int(v)
-        if isinstance(v, float):
-            return int(round(v))
-    except Exception:
-        pass
-    s = str(v).strip()
-    if s == "":
-        return 0
-    s = s.replace(" ", "").replace("'", "")
-    # gestione separatori
-    if "." in s and "," in s:
-        last_dot = s.rfind('.')
-        last_comma = s.rfind(',')
-        if last_dot > last_comma:
-            s = s.replace(',', '')
-        else:
-            s = s.replace('.', '').replace(',', '.')
-    else:
-        if "." in s and "," not in s:
-            parts = s.split('.')
-            if all(len(p) == 3 for p in parts[1:]):
-                s = s.replace('.', '')
-        if "," in s and "." not in s:
-            parts = s.split(',')
-            if all(len(p) == 3 for p in parts[1:]):
-                s = s.replace(',', '')
-            else:
-                s = s.replace(',', '.')
-    try:
-        f = float(s)
-        return int(round(f))
-    except Exception:
-        digits = re.sub(r'\D', '', s)
-        if digits == "":
-            return 0
-        return int(digits)
-
 def ensure_list_entry(v):
     """Normalizza il valore a lista di dict [{'quantità':..,'location':..}, ...]"""
     if v is None:
@@ -133,47 +76,15 @@ def ensure_list_entry(v):
     except Exception:
         return []
 
-# ----------- get_locations_and_total (location principale: quantità massima) -----------
-def get_locations_and_total(stock_dict, key):
-    """
-    Restituisce (list_of_tuples [(location, qty)], main_qty).
-    Qui prendiamo LA location principale: la riga con quantità *maggiore*.
-    Restituiamo la lista con un solo elemento (location_principale, qty) se presente.
-    main_qty è la quantità di quella location.
-    """
-    entries = stock_dict.get(key)
-    if entries is None:
-        return [], 0
-
-    # Normalize entries to list
-    if isinstance(entries, dict):
-        entries_list = [entries]
-    elif isinstance(entries, (list, tuple)):
-        entries_list = list(entries)
-    else:
-        q = try_int(entries)
-        return [("", q)], q
-
-    max_loc = None
-    max_qty = -1
-    for rec in entries_list:
-        if not isinstance(rec, dict):
-            q = try_int(rec)
-            loc = ""
-        else:
-            q = try_int(rec.get("quantità", 0))
-            loc = str(rec.get("location", "") or "").strip()
-        if q > max_qty:
-            max_qty = q
-            max_loc = loc
-
-    if max_loc is None:
-        return [], 0
-    return [(max_loc, max_qty)], max_qty
-
 def deep_copy_stock(s):
     return copy.deepcopy(s)
 
+def riga_stato_file(res):
+    """Riga markdown di stato per un file elaborato da parse_stock_file."""
+    if res["errore"]:
+        return f"- ❌ {res['nome']}: {res['errore']}"
+    return f"- ✅ {res['nome']}: {len(res['righe'])} righe"
+
 # ---------------- Load persistent data ----------------
 richiesta = carica_csv_safe(RICHIESTE_FILE, [COL_ITEM_CODE, COL_QTA_RICHIESTA, COL_ORDER, TS_COL])
 stock_in_mano_raw = carica_pickle_safe(STOCK_MANO_FILE)
@@ -205,7 +116,9 @@ if "confirm_prompt" not in st.session_state:
 page = st.sidebar.radio("Menu", [
     "Carica Stock In Mano",
     "Carica Stock Riserva",
-    "Analisi Richieste & Suggerimenti"
+    "Carica Stock Multiplo",
+    "Analisi Richieste & Suggerimenti",
+    "Simulazione What-if"
 ])
 soglia = st.sidebar.number_input("Soglia alert stock in mano", min_value=1, max_value=10000, value=20)
 show_debug = st.sidebar.checkbox("Mostra debug (prime chiavi)", False)
@@ -218,66 +131,97 @@ if page == "Carica Stock In Mano":
     st.title("📥 Carica Stock - IN MANO")
     up = st.file_uploader("Carica file Excel stock in mano (Item Code, Quantità, Location)", type=["xlsx", "xls"])
     if up:
-        df = pd.read_excel(up)
-        st.write("Colonne trovate:", df.columns.tolist())
-        rename = {}
-        for c in df.columns:
-            lc = c.strip().lower()
-            if lc in ["item code", "itemcode", "item number", "item_number", "item"]:
-                rename[c] = COL_ITEM_CODE
-            if lc in ["quantità", "quantita", "quantity", "qty"]:
-                rename[c] = COL_QUANTITA
-            if lc in ["location", "loc"]:
-                rename[c] = COL_LOCATION
-        if rename:
-            df.rename(columns=rename, inplace=True)
-
-        if COL_ITEM_CODE in df.columns and COL_QUANTITA in df.columns and COL_LOCATION in df.columns:
-            grouped = df.groupby([COL_ITEM_CODE, COL_LOCATION])[COL_QUANTITA].sum().reset_index()
-            for _, r in grouped.iterrows():
-                key = norma_item(r[COL_ITEM_CODE])
-                q = try_int(r[COL_QUANTITA])
-                loc = str(r[COL_LOCATION]).strip()
-                existing = stock_in_mano.get(key, [])
-                existing.append({"quantità": q, "location": loc})
-                stock_in_mano[key] = existing
+        res = parse_stock_file(up.name, up.getvalue())
+        st.write("Colonne trovate:", res["colonne"])
+        if res["errore"]:
+            st.error(res["errore"])
+        else:
+            aggiungi_righe_stock(stock_in_mano, res["righe"])
             salva_pickle(STOCK_MANO_FILE, stock_in_mano)
             st.success("Stock in mano salvato e aggregato correttamente.")
-        else:
-            st.error(f"File mancante colonne: '{COL_ITEM_CODE}', '{COL_QUANTITA}', '{COL_LOCATION}'.")
 
 # ---------------- Page: Carica Stock Riserva ----------------
 elif page == "Carica Stock Riserva":
     st.title("📥 Carica Stock - RISERVA")
     up = st.file_uploader("Carica file Excel stock riserva (Item Code, Quantità, Location)", type=["xlsx", "xls"])
     if up:
-        df = pd.read_excel(up)
-        st.write("Colonne trovate:", df.columns.tolist())
-        rename = {}
-        for c in df.columns:
-            lc = c.strip().lower()
-            if lc in ["item code", "itemcode", "item number", "item_number", "item"]:
-                rename[c] = COL_ITEM_CODE
-            if lc in ["quantità", "quantita", "quantity", "qty"]:
-                rename[c] = COL_QUANTITA
-            if lc in ["location", "loc"]:
-                rename[c] = COL_LOCATION
-        if rename:
-            df.rename(columns=rename, inplace=True)
-
-        if COL_ITEM_CODE in df.columns and COL_QUANTITA in df.columns and COL_LOCATION in df.columns:
-            grouped = df.groupby([COL_ITEM_CODE, COL_LOCATION])[COL_QUANTITA].sum().reset_index()
-            for _, r in grouped.iterrows():
-                key = norma_item(r[COL_ITEM_CODE])
-                q = try_int(r[COL_QUANTITA])
-                loc = str(r[COL_LOCATION]).strip()
-                existing = stock_in_riserva.get(key, [])
-                existing.append({"quantità": q, "location": loc})
-                stock_in_riserva[key] = existing
+        res = parse_stock_file(up.name, up.getvalue())
+        st.write("Colonne trovate:", res["colonne"])
+        if res["errore"]:
+            st.error(res["errore"])
+        else:
+            aggiungi_righe_stock(stock_in_riserva, res["righe"])
             salva_pickle(STOCK_RISERVA_FILE, stock_in_riserva)
             st.success("Stock riserva salvato correttamente.")
-        else:
-            st.error(f"File mancante colonne: '{COL_ITEM_CODE}', '{COL_QUANTITA}', '{COL_LOCATION}'.")
+
+# ---------------- Page: Carica Stock Multiplo ----------------
+elif page == "Carica Stock Multiplo":
+    st.title("📥 Carica Stock - MULTIPLO")
+    destinazione = st.radio("Destinazione", ["In Mano", "Riserva"], horizontal=True)
+    files = st.file_uploader(
+        "Carica uno o più file Excel stock (Item Code, Quantità, Location)",
+        type=["xlsx", "xls"],
+        accept_multiple_files=True
+    )
+    if files and st.button("Elabora file"):
+        # Parsing + normalizzazione in processi separati (openpyxl è CPU-bound e tiene il GIL)
+        payload = [(f.name, f.getvalue()) for f in files]
+        risultati = {}
+        progress = st.progress(0.0, text=f"0/{len(payload)} file elaborati")
+        stato_file = st.empty()
+        righe_stato = []
+
+        def registra(i, res):
+            risultati[i] = res
+            righe_stato.append(riga_stato_file(res))
+            stato_file.markdown("\n".join(righe_stato))
+            progress.progress(len(risultati) / len(payload), text=f"{len(risultati)}/{len(payload)} file elaborati")
+
+        # spawn: niente fork del server Streamlit multithread. main_senza_script evita che ogni worker
+        # riesegua app.py come __mp_main__: così l'avvio costa solo un interprete nuovo più l'import di
+        # ingestione/pandas (misurato ~0.15 s per worker senza pandas, Python 3.11; l'import di pandas si somma).
+        pool = None
+        futures = {}
+        try:
+            with main_senza_script():
+                pool = ProcessPoolExecutor(max_workers=min(len(payload), os.cpu_count() or 1),
+                                           mp_context=multiprocessing.get_context("spawn"))
+                futures = {pool.submit(parse_stock_file, nome, dati): i for i, (nome, dati) in enumerate(payload)}
+        except (BrokenProcessPool, OSError) as e:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            pool = None
+            st.warning(f"Elaborazione parallela non disponibile ({e}); elaborazione sequenziale.")
+        if pool is not None:
+            with pool:
+                for fut in as_completed(futures):
+                    try:
+                        res = fut.result()
+                    except (BrokenProcessPool, OSError) as e:
+                        # pool interrotto: i file mancanti vengono elaborati in sequenza più sotto
+                        st.warning(f"Pool di processi interrotto ({e}); elaborazione sequenziale dei file rimanenti.")
+                        break
+                    registra(futures[fut], res)
+        for i, (nome, dati) in enumerate(payload):
+            if i not in risultati:
+                registra(i, parse_stock_file(nome, dati))
+
+        # Merge unico, nell'ordine di caricamento dei file
+        target = stock_in_mano if destinazione == "In Mano" else stock_in_riserva
+        ok = 0
+        for i in range(len(payload)):
+            res = risultati[i]
+            if res["errore"]:
+                st.error(f"{res['nome']}: {res['errore']} Colonne trovate: {res['colonne']}")
+                continue
+            aggiungi_righe_stock(target, res["righe"])
+            ok += 1
+        if ok:
+            if destinazione == "In Mano":
+                salva_pickle(STOCK_MANO_FILE, stock_in_mano)
+            else:
+                salva_pickle(STOCK_RISERVA_FILE, stock_in_riserva)
+            st.success(f"{ok}/{len(payload)} file aggregati e salvati nello stock {destinazione.lower()}.")
 
 # ---------------- Page: Analisi Richieste & Suggerimenti ----------------
 elif page == "Analisi Richieste & Suggerimenti":
@@ -340,14 +284,7 @@ elif page == "Analisi Richieste & Suggerimenti":
                 loc_mano_display = locs_mano[0][0] if locs_mano else "non definita"
                 q_mano = main_mano_qty
                 if q_mano < soglia:
-                    reserve_locs = []
-                    val = stock_in_riserva.get(key, [])
-                    for rec in val:
-                        if isinstance(rec, dict):
-                            loc = str(rec.get("location","")).strip()
-                            q = try_int(rec.get("quantità", 0))
-                            if "inventory" in loc.lower():
-                                reserve_locs.append((loc, q))
+                    reserve_locs = reserve_inventory(stock_in_riserva, key)
                     if reserve_locs:
                         suggestions = [f"{q} da {loc}" for (loc, q) in reserve_locs]
                         st.warning(f"'{key}' sotto soglia! In mano: {q_mano} ({loc_mano_display}). Suggerito da riserva: {', '.join(suggestions)}")
@@ -384,74 +321,36 @@ elif page == "Analisi Richieste & Suggerimenti":
                 filtro = richiesta[richiesta[COL_ORDER] == ordine_sel]
                 grouped = filtro.groupby(COL_ITEM_CODE, as_index=False)[COL_QTA_RICHIESTA].sum()
 
-                rows = []
-                pending_allocations = []
+                righe_ordine = {}
                 for _, r in grouped.iterrows():
                     item = norma_item(r[COL_ITEM_CODE])
-                    req_qta = try_int(r[COL_QTA_RICHIESTA])
-
-                    locs_mano, q_mano = get_locations_and_total(stock_in_mano, item)
-                    loc_mano_display = "; ".join([f"{l} ({q})" for l,q in locs_mano]) if locs_mano else "non definita"
+                    righe_ordine[item] = righe_ordine.get(item, 0) + try_int(r[COL_QTA_RICHIESTA])
+                _, pending_allocations = valuta_ordine(stock_in_mano, stock_in_riserva, righe_ordine)
 
+                rows = []
+                for p in pending_allocations:
+                    req_qta = p["richiesta"]
+                    q_mano = p["disponibile_mano"]
+                    allocs = p["reserve_alloc"]
+                    loc_mano_display = "; ".join([f"{l} ({q})" for l,q in p["location_mano"]]) if p["location_mano"] else "non definita"
                     if q_mano >= req_qta:
-                        rows.append({
-                            "Item Code": item,
-                            "Requested_quantity": req_qta,
-                            "Quantità disponibile": q_mano,
-                            "Location stock in mano": loc_mano_display,
-                            "Quantità da prelevare": 0,
-                            "Location riserva (INVENTORY)": "",
-                            "Status": "Disponibile",
-                            "Status Icon": "✅"
-                        })
-                        pending_allocations.append({
-                            "item": item,
-                            "from_mano": req_qta,
-                            "reserve_alloc": []
-                        })
+                        status, icon = "Disponibile", "✅"
+                    elif allocs and p["mancante"] <= 0:
+                        status, icon = "Da riserva (coperto)", "⚠️"
+                    elif allocs:
+                        status, icon = "Non sufficiente (anche da riserva)", "⚠️"
                     else:
-                        missing = req_qta - q_mano
-                        reserve_list = []
-                        val = stock_in_riserva.get(item, [])
-                        for rec in val:
-                            if isinstance(rec, dict):
-                                loc = str(rec.get("location","")).strip()
-                                q = try_int(rec.get("quantità", 0))
-                                if "inventory" in loc.lower():
-                                    reserve_list.append([loc, q])
-                        allocs = []
-                        left = missing
-                        for loc, q in reserve_list:
-                            if left <= 0:
-                                break
-                            take = min(left, q)
-                            if take > 0:
-                                allocs.append({"location": loc, "qty": take})
-                                left -= take
-                        total_reserved = sum(a["qty"] for a in allocs)
-                        if total_reserved >= missing and total_reserved > 0:
-                            status = "Da riserva (coperto)"
-                        elif total_reserved > 0:
-                            status = "Non sufficiente (anche da riserva)"
-                        else:
-                            status = "Non disponibile in riserva INVENTORY"
-
-                        rows.append({
-                            "Item Code": item,
-                            "Requested_quantity": req_qta,
-                            "Quantità disponibile": q_mano,
-                            "Location stock in mano": loc_mano_display,
-                            "Quantità da prelevare": (req_qta - q_mano) if allocs else req_qta,
-                            "Location riserva (INVENTORY)": "; ".join([f'{a["location"]} ({a["qty"]})' for a in allocs]),
-                            "Status": status,
-                            "Status Icon": "⚠️" if total_reserved > 0 else "❌"
-                        })
-
-                        pending_allocations.append({
-                            "item": item,
-                            "from_mano": q_mano,
-                            "reserve_alloc": allocs
-                        })
+                        status, icon = "Non disponibile in riserva INVENTORY", "❌"
+                    rows.append({
+                        "Item Code": p["item"],
+                        "Requested_quantity": req_qta,
+                        "Quantità disponibile": q_mano,
+                        "Location stock in mano": loc_mano_display,
+                        "Quantità da prelevare": 0 if q_mano >= req_qta else ((req_qta - q_mano) if allocs else req_qta),
+                        "Location riserva (INVENTORY)": "; ".join([f'{a["location"]} ({a["qty"]})' for a in allocs]),
+                        "Status": status,
+                        "Status Icon": icon
+                    })
 
                 st.session_state["pending_picks"] = pending_allocations
                 st.session_state["pre_pick_backup"][ordine_sel] = {
@@ -508,40 +407,7 @@ elif page == "Analisi Richieste & Suggerimenti":
                         with ccol:
                             if st.button("Sì, conferma", key=f"confirm_yes_{ordine_key}"):
                                 # Apply picks
-                                pending = st.session_state.get("pending_picks", [])
-                                for pick in pending:
-                                    item = pick["item"]
-                                    take_from_mano = pick.get("from_mano", 0)
-                                    if take_from_mano and item in stock_in_mano:
-                                        rec_list = stock_in_mano[item]
-                                        left = take_from_mano
-                                        newlist = []
-                                        for r in rec_list:
-                                            if left <= 0:
-                                                newlist.append(r)
-                                                continue
-                                            available = try_int(r.get("quantità", 0))
-                                            used = min(available, left)
-                                            remaining = available - used
-                                            left -= used
-                                            r["quantità"] = max(0, remaining)
-                                            newlist.append(r)
-                                        stock_in_mano[item] = newlist
-
-                                    for alloc in pick.get("reserve_alloc", []):
-                                        loc = alloc["location"]
-                                        qty_to_take = alloc["qty"]
-                                        val_list = stock_in_riserva.get(item, [])
-                                        newlist = []
-                                        left_alloc = qty_to_take
-                                        for r in val_list:
-                                            if isinstance(r, dict) and str(r.get("location","")).strip() == loc and left_alloc > 0:
-                                                available = try_int(r.get("quantità", 0))
-                                                used = min(available, left_alloc)
-                                                r["quantità"] = max(0, available - used)
-                                                left_alloc -= used
-                                            newlist.append(r)
-                                        stock_in_riserva[item] = newlist
+                                applica_prelievi(stock_in_mano, stock_in_riserva, st.session_state.get("pending_picks", []))
 
                                 salva_pickle(STOCK_MANO_FILE, stock_in_mano)
                                 salva_pickle(STOCK_RISERVA_FILE, stock_in_riserva)
@@ -610,6 +476,104 @@ elif page == "Analisi Richieste & Suggerimenti":
                                 st.session_state["confirm_prompt"] = {"type": None, "order": None}
                                 st.info("Annullamento prelievo cancellato dall'utente.")
 
+# ---------------- Page: Simulazione What-if ----------------
+elif page == "Simulazione What-if":
+    st.title("🧮 Simulazione What-if copertura ordini")
+    st.caption("Sola lettura: lo stock salvato e i backup di sessione non vengono modificati.")
+
+    backlog_df = richiesta.dropna(subset=[COL_ORDER]) if COL_ORDER in richiesta.columns else richiesta.iloc[0:0]
+    escludi_confermati = st.checkbox(
+        "Escludi ordini già confermati (storico verifiche)", True,
+        help="L'annullamento di un prelievo non rimuove le righe dallo storico verifiche: "
+             "anche gli ordini confermati e poi annullati vengono esclusi. Disattiva per includerli."
+    )
+    if escludi_confermati and os.path.exists(STORICO_VERIFICHE_FILE):
+        try:
+            confermati = set(pd.read_csv(STORICO_VERIFICHE_FILE)["Order Number"].dropna().map(norma_item))
+            backlog_df = backlog_df[~backlog_df[COL_ORDER].map(norma_item).isin(confermati)]
+        except Exception as e:
+            st.warning(f"Impossibile leggere lo storico verifiche ({e}): gli ordini già confermati NON sono esclusi.")
+
+    if backlog_df.empty:
+        st.info("Nessun ordine in attesa nello storico richieste.")
+    else:
+        priorita = st.selectbox("Priorità di evasione", list(PRIORITA.keys()), format_func=lambda k: PRIORITA[k])
+        if priorita == "personalizzata":
+            testo_ordini = st.text_area(
+                "Order Number in ordine di priorità (uno per riga o separati da virgola; i non elencati seguono in FIFO)"
+            )
+            sequenza = [o for o in testo_ordini.replace(",", "\n").split() if o]
+            if sequenza:
+                priorita = sequenza
+            else:
+                st.info("Nessun Order Number inserito: viene usato l'ordine FIFO.")
+
+        st.markdown("**Trasferimenti riserva → in mano** (eseguiti prima degli ordini; Location riserva vuota = location INVENTORY)")
+        df_trasf = st.data_editor(
+            pd.DataFrame({COL_ITEM_CODE: pd.Series(dtype=str), COL_QUANTITA: pd.Series(dtype=int),
+                          "Location riserva": pd.Series(dtype=str), "Location in mano": pd.Series(dtype=str)}),
+            num_rows="dynamic", key="sim_trasferimenti"
+        )
+        st.markdown("**Consegne in arrivo** (Location vuota = location principale in mano / prima location INVENTORY in riserva)")
+        df_arrivi = st.data_editor(
+            pd.DataFrame({COL_ITEM_CODE: pd.Series(dtype=str), COL_QUANTITA: pd.Series(dtype=int),
+                          COL_LOCATION: pd.Series(dtype=str), "Stock": pd.Series(dtype=str)}),
+            num_rows="dynamic", key="sim_arrivi",
+            column_config={"Stock": st.column_config.SelectboxColumn("Stock", options=["mano", "riserva"], default="mano")}
+        )
+
+        if st.button("Esegui simulazione"):
+            # Come in "Verifica ordine" (groupby scarta gli Item Code mancanti) le righe senza item non contano
+            backlog = prepara_backlog(
+                (o, norma_item(i), q, None if pd.isna(ts) else ts)
+                for o, i, q, ts in zip(backlog_df[COL_ORDER], backlog_df[COL_ITEM_CODE],
+                                       backlog_df[COL_QTA_RICHIESTA], backlog_df[TS_COL])
+                if norma_item(i)
+            )
+            trasferimenti = [
+                {"item": norma_item(r[COL_ITEM_CODE]), "qty": try_int(r[COL_QUANTITA]),
+                 "da": "" if pd.isna(r["Location riserva"]) else r["Location riserva"],
+                 "a": "" if pd.isna(r["Location in mano"]) else r["Location in mano"]}
+                for _, r in df_trasf.iterrows() if norma_item(r[COL_ITEM_CODE])
+            ]
+            arrivi = [
+                {"item": norma_item(r[COL_ITEM_CODE]), "qty": try_int(r[COL_QUANTITA]),
+                 "location": "" if pd.isna(r[COL_LOCATION]) else r[COL_LOCATION],
+                 "stock": "mano" if pd.isna(r["Stock"]) else r["Stock"]}
+                for _, r in df_arrivi.iterrows() if norma_item(r[COL_ITEM_CODE])
+            ]
+            for a in arrivi:
+                loc = str(a["location"]).strip()
+                if a["stock"] == "riserva" and loc and "inventory" not in loc.lower():
+                    st.warning(f"Arrivo in riserva per '{a['item']}' su '{loc}': non è una location INVENTORY, quindi non conta per la copertura.")
+
+            base = simula(stock_in_mano, stock_in_riserva, backlog, priorita=priorita)
+            scenario = simula(stock_in_mano, stock_in_riserva, backlog, trasferimenti, arrivi, priorita)
+            mb, ms = base["metriche"], scenario["metriche"]
+
+            st.subheader(f"Risultati su {ms['ordini']} ordini (scenario vs stock attuale)")
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric(ESITO_MANO, ms["coperti_mano"], ms["coperti_mano"] - mb["coperti_mano"])
+            c2.metric(ESITO_RISERVA, ms["coperti_riserva"], ms["coperti_riserva"] - mb["coperti_riserva"])
+            c3.metric(ESITO_SCOPERTO, ms["non_coperti"], ms["non_coperti"] - mb["non_coperti"], delta_color="inverse")
+            c4.metric("Fill rate ordini", f"{ms['fill_rate_ordini']:.1%}", f"{ms['fill_rate_ordini'] - mb['fill_rate_ordini']:+.1%}")
+            c5, c6 = st.columns(2)
+            c5.metric("Fill rate righe", f"{ms['fill_rate_righe']:.1%}", f"{ms['fill_rate_righe'] - mb['fill_rate_righe']:+.1%}")
+            c6.metric("Fill rate quantità", f"{ms['fill_rate_quantita']:.1%}", f"{ms['fill_rate_quantita'] - mb['fill_rate_quantita']:+.1%}")
+
+            df_sim = pd.DataFrame(scenario["ordini"])
+            df_sim["Esito senza scenario"] = [o["Esito"] for o in base["ordini"]]
+            st.dataframe(df_sim)
+
+            buf = BytesIO()
+            df_sim.to_excel(buf, index=False)
+            st.download_button(
+                label="📥 Scarica report simulazione (Excel)",
+                data=buf.getvalue(),
+                file_name="simulazione_copertura.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
 # ---------------- Sidebar: Ricerca Rapida (Location principale) ----------------
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 🔎 Ricerca Rapida")
@@ -0,0 +1,184 @@
+# ingestione.py - RAD-TEST parsing file stock (importabile dai processi worker, senza Streamlit)
+import re
+import sys
+import types
+from contextlib import contextmanager
+import pandas as pd
+from io import BytesIO
+
+# ---------------- Constants ----------------
+COL_ITEM_CODE = "Item Code"
+COL_LOCATION = "Location"
+COL_QUANTITA = "Quantità"
+
+# ---------------- Normalization & robust parsing ----------------
+def norma_item(x):
+    """Normalizza Item Code: gestisce int/float/str e rimuove .0 finali."""
+    if pd.isna(x):
+        return ""
+    if isinstance(x, int):
+        return str(x)
+    if isinstance(x, float):
+        if x.is_integer():
+            return str(int(x))
+        return repr(x)
+    s = str(x).strip()
+    s = s.replace('\u200b', '').strip()
+    if re.match(r'^\d+\.0+$', s):
+        s = s.split('.')[0]
+    return s.upper()
+
+def try_int(v):
+    """Parsing robusto di quantità: gestisce int/float/string con separatori."""
+    if v is None:
+        return 0
+    try:
+        if isinstance(v, int):
+            return int(v)
+        if isinstance(v, float):
+            return int(round(v))
+    except Exception:
+        pass
+    s = str(v).strip()
+    if s == "":
+        return 0
+    s = s.replace(" ", "").replace("'", "")
+    # gestione separatori
+    if "." in s and "," in s:
+        last_dot = s.rfind('.')
+        last_comma = s.rfind(',')
+        if last_dot > last_comma:
+            s = s.replace(',', '')
+        else:
+            s = s.replace('.', '').replace(',', '.')
+    else:
+        if "." in s and "," not in s:
+            parts = s.split('.')
+            if all(len(p) == 3 for p in parts[1:]):
+                s = s.replace('.', '')
+        if "," in s and "." not in s:
+            parts = s.split(',')
+            if all(len(p) == 3 for p in parts[1:]):
+                s = s.replace(',', '')
+            else:
+                s = s.replace(',', '.')
+    try:
+        f = float(s)
+        return int(round(f))
+    except Exception:
+        digits = re.sub(r'\D', '', s)
+        if digits == "":
+            return 0
+        return int(digits)
+
+# ----------- get_locations_and_total (location principale: quantità massima) -----------
+def get_locations_and_total(stock_dict, key):
+    """
+    Restituisce (list_of_tuples [(location, qty)], main_qty).
+    Qui prendiamo LA location principale: la riga con quantità *maggiore*.
+    Restituiamo la lista con un solo elemento (location_principale, qty) se presente.
+    main_qty è la quantità di quella location.
+    """
+    entries = stock_dict.get(key)
+    if entries is None:
+        return [], 0
+
+    # Normalize entries to list
+    if isinstance(entries, dict):
+        entries_list = [entries]
+    elif isinstance(entries, (list, tuple)):
+        entries_list = list(entries)
+    else:
+        q = try_int(entries)
+        return [("", q)], q
+
+    max_loc = None
+    max_qty = -1
+    for rec in entries_list:
+        if not isinstance(rec, dict):
+            q = try_int(rec)
+            loc = ""
+        else:
+            q = try_int(rec.get("quantità", 0))
+            loc = str(rec.get("location", "") or "").strip()
+        if q > max_qty:
+            max_qty = q
+            max_loc = loc
+
+    if max_loc is None:
+        return [], 0
+    return [(max_loc, max_qty)], max_qty
+
+# ---------------- Parsing file stock (worker) ----------------
+def parse_stock_file(nome, contenuto):
+    """
+    Legge un file Excel stock (bytes) e restituisce un dict con:
+    - 'nome': nome del file
+    - 'colonne': colonne trovate nel file
+    - 'righe': lista di (item_code_normalizzato, quantità, location)
+    - 'errore': messaggio di errore oppure None
+    Funzione top-level e senza dipendenze da Streamlit, così può girare in un ProcessPoolExecutor.
+    Non solleva mai eccezioni: un file non valido restituisce solo il proprio 'errore'.
+    """
+    colonne = []
+    try:
+        df = pd.read_excel(BytesIO(contenuto))
+        colonne = df.columns.tolist()
+        rename = {}
+        for c in df.columns:
+            lc = str(c).strip().lower()
+            if lc in ["item code", "itemcode", "item number", "item_number", "item"]:
+                rename[c] = COL_ITEM_CODE
+            if lc in ["quantità", "quantita", "quantity", "qty"]:
+                rename[c] = COL_QUANTITA
+            if lc in ["location", "loc"]:
+                rename[c] = COL_LOCATION
+        if rename:
+            df.rename(columns=rename, inplace=True)
+
+        if not (COL_ITEM_CODE in df.columns and COL_QUANTITA in df.columns and COL_LOCATION in df.columns):
+            return {
+                "nome": nome,
+                "colonne": colonne,
+                "righe": [],
+                "errore": f"File mancante colonne: '{COL_ITEM_CODE}', '{COL_QUANTITA}', '{COL_LOCATION}'."
+            }
+        if df.columns.duplicated().any():
+            doppie = sorted(set(str(c) for c in df.columns[df.columns.duplicated()]))
+            return {"nome": nome, "colonne": colonne, "righe": [], "errore": f"Colonne duplicate dopo la normalizzazione: {doppie}."}
+
+        # Quantità convertite prima del groupby: una colonna mista numeri/testo non fa fallire la somma
+        df[COL_QUANTITA] = df[COL_QUANTITA].apply(try_int)
+        grouped = df.groupby([COL_ITEM_CODE, COL_LOCATION])[COL_QUANTITA].sum().reset_index()
+        righe = [
+            (norma_item(item), try_int(q), str(loc).strip())
+            for item, loc, q in zip(grouped[COL_ITEM_CODE], grouped[COL_LOCATION], grouped[COL_QUANTITA])
+        ]
+    except Exception as e:
+        return {"nome": nome, "colonne": colonne, "righe": [], "errore": f"Elaborazione fallita: {e}"}
+    return {"nome": nome, "colonne": colonne, "righe": righe, "errore": None}
+
+@contextmanager
+def main_senza_script():
+    """
+    Durante l'esecuzione Streamlit punta sys.modules["__main__"] ad app.py (con __file__):
+    un worker 'spawn' rieseguirebbe tutto lo script come __mp_main__ prima di elaborare i file.
+    Mentre il pool avvia i processi si sostituisce __main__ con un modulo vuoto senza __file__,
+    così i worker importano solo ingestione; poi si ripristina il modulo originale.
+    """
+    originale = sys.modules.get("__main__")
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        if originale is not None:
+            sys.modules["__main__"] = originale
+        else:
+            del sys.modules["__main__"]
+
+def aggiungi_righe_stock(stock, righe):
+    """Accoda le righe (item, quantità, location) di parse_stock_file allo stock (dict modificato in place)."""
+    for key, q, loc in righe:
+        existing = stock.get(key, [])
+        existing.append({"quantità": q, "location": loc})
+        stock[key] = existing
@@ -0,0 +1,271 @@
+# simulazione.py - RAD-TEST disponibilità/prelievo ordini e simulazione what-if (senza Streamlit)
+from ingestione import norma_item, try_int, get_locations_and_total
+
+PRIORITA = {
+    "fifo": "Più vecchi prima (Timestamp)",
+    "ordine": "Per Order Number",
+    "piccoli_prima": "Ordini più piccoli prima",
+    "grandi_prima": "Ordini più grandi prima",
+    "personalizzata": "Sequenza personalizzata di Order Number",
+}
+
+ESITO_MANO = "Coperto da IN MANO"
+ESITO_RISERVA = "Coperto con RISERVA"
+ESITO_SCOPERTO = "Non coperto"
+
+LOCATION_INVENTORY_DEFAULT = "INVENTORY"
+
+# ---------------- Prelievo ----------------
+def preleva_righe(recs, qty, location=None):
+    """
+    Scala fino a qty dalla lista di record (in place, nell'ordine della lista),
+    solo dalla location indicata se presente. Restituisce la quantità prelevata.
+    Usata sia da "Conferma prelievo" sia dalla simulazione.
+    """
+    left = qty
+    for r in recs:
+        if left <= 0:
+            break
+        if not isinstance(r, dict):
+            continue
+        if location is not None and str(r.get("location", "")).strip() != location:
+            continue
+        available = try_int(r.get("quantità", 0))
+        used = min(available, left)
+        r["quantità"] = max(0, available - used)
+        left -= used
+    return qty - left
+
+# ---------------- Vista copy-on-write dello stock ----------------
+class VistaStock:
+    """
+    Vista copy-on-write su un dict stock {item: [{'quantità':..,'location':..}, ...]}.
+    Le letture passano al dict base; un item viene copiato solo alla prima modifica,
+    quindi lo stock originale (e i backup in session_state) non vengono mai toccati.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.modificati = {}
+
+    def get(self, key, default=None):
+        if key in self.modificati:
+            return self.modificati[key]
+        return self.base.get(key, default)
+
+    def scrivibile(self, key):
+        if key not in self.modificati:
+            entries = self.base.get(key, [])
+            if isinstance(entries, dict):
+                entries = [entries]
+            elif not isinstance(entries, (list, tuple)):
+                entries = [{"quantità": try_int(entries), "location": ""}]
+            self.modificati[key] = [
+                dict(r) if isinstance(r, dict) else {"quantità": try_int(r), "location": ""}
+                for r in entries
+            ]
+        return self.modificati[key]
+
+    def aggiungi(self, key, qty, location=""):
+        """Aggiunge qty alla location indicata (o alla location principale se vuota)."""
+        if qty <= 0:
+            return
+        loc = str(location or "").strip()
+        if not loc:
+            locs, _ = get_locations_and_total(self, key)
+            loc = locs[0][0] if locs else ""
+        recs = self.scrivibile(key)
+        for r in recs:
+            if str(r.get("location", "")).strip() == loc:
+                r["quantità"] = try_int(r.get("quantità", 0)) + qty
+                return
+        recs.append({"quantità": qty, "location": loc})
+
+    def preleva(self, key, qty, location=None):
+        """Scala fino a qty (solo dalla location indicata, se presente). Restituisce la quantità prelevata."""
+        if qty <= 0 or self.get(key) is None:
+            return 0
+        return preleva_righe(self.scrivibile(key), qty, location)
+
+def applica_prelievi(mano, riserva, allocazioni):
+    """
+    Scala le allocazioni (formato pending_picks) da mano e riserva.
+    Con dict stock la modifica è in place (Conferma prelievo); con VistaStock resta nella vista.
+    """
+    for pick in allocazioni:
+        item = pick["item"]
+        for stock, qty, loc in [(mano, pick.get("from_mano", 0), None)] + [
+            (riserva, a["qty"], a["location"]) for a in pick.get("reserve_alloc", [])
+        ]:
+            if not qty:
+                continue
+            if isinstance(stock, VistaStock):
+                stock.preleva(item, qty, location=loc)
+            elif isinstance(stock.get(item), list):
+                preleva_righe(stock[item], qty, location=loc)
+
+def reserve_inventory(stock, item):
+    """Location INVENTORY in riserva per l'item: lista di (location, qty) nell'ordine dello stock."""
+    out = []
+    for rec in stock.get(item, []) or []:
+        if isinstance(rec, dict):
+            loc = str(rec.get("location", "")).strip()
+            q = try_int(rec.get("quantità", 0))
+            if "inventory" in loc.lower():
+                out.append((loc, q))
+    return out
+
+# ---------------- Backlog ----------------
+def prepara_backlog(righe):
+    """
+    Raggruppa righe (ordine, item, qta, timestamp) per ordine e item (timestamp None = mancante).
+    Restituisce lista di dict {'ordine', 'righe': {item: qta}, 'totale', 'ts', 'pos'}.
+    """
+    ordini = {}
+    for ordine, item, qta, ts in righe:
+        o = ordini.get(ordine)
+        if o is None:
+            o = {"ordine": ordine, "righe": {}, "totale": 0, "ts": ts, "pos": len(ordini)}
+            ordini[ordine] = o
+        q = try_int(qta)
+        o["righe"][item] = o["righe"].get(item, 0) + q
+        o["totale"] += q
+        if ts is not None and (o["ts"] is None or ts < o["ts"]):
+            o["ts"] = ts
+    return list(ordini.values())
+
+def chiave_order_number(ordine):
+    """Chiave di ordinamento: Order Number numerici per valore (10 < 999 < 1001), poi gli altri come testo."""
+    try:
+        return (0, float(str(ordine).strip()), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, str(ordine))
+
+def ordina_backlog(backlog, priorita="fifo"):
+    """
+    Ordina il backlog secondo una chiave di PRIORITA oppure una lista esplicita di Order Number.
+    Con la lista, gli ordini non elencati seguono in coda in ordine FIFO.
+    """
+    if isinstance(priorita, (list, tuple)):
+        rank = {}
+        for i, o in enumerate(priorita):
+            rank.setdefault(norma_item(o), i)
+        return sorted(ordina_backlog(backlog, "fifo"), key=lambda o: rank.get(norma_item(o["ordine"]), len(rank)))
+    if priorita == "ordine":
+        return sorted(backlog, key=lambda o: (chiave_order_number(o["ordine"]), o["pos"]))
+    if priorita == "piccoli_prima":
+        return sorted(backlog, key=lambda o: (o["totale"], o["pos"]))
+    if priorita == "grandi_prima":
+        return sorted(backlog, key=lambda o: (-o["totale"], o["pos"]))
+    # fifo: timestamp mancanti in coda, a parità vale l'ordine di caricamento
+    datati = sorted((o for o in backlog if o["ts"] is not None), key=lambda o: (o["ts"], o["pos"]))
+    return datati + [o for o in backlog if o["ts"] is None]
+
+# ---------------- Scenario ----------------
+def applica_scenario(mano, riserva, trasferimenti=(), arrivi=()):
+    """
+    Applica lo scenario alle viste prima di evadere gli ordini.
+    - trasferimenti: [{'item', 'qty', 'da' (location riserva, vuota = INVENTORY), 'a' (location in mano)}]
+    - arrivi: [{'item', 'qty', 'location', 'stock': 'mano' | 'riserva'}]
+      In riserva una location vuota diventa la prima location INVENTORY dell'item
+      (o LOCATION_INVENTORY_DEFAULT), altrimenti l'arrivo non conterebbe per la copertura.
+    """
+    for t in trasferimenti:
+        item = t["item"]
+        left = try_int(t.get("qty", 0))
+        da = str(t.get("da", "") or "").strip()
+        sorgenti = [da] if da else [loc for loc, _ in reserve_inventory(riserva, item)]
+        spostato = 0
+        for loc in sorgenti:
+            if left <= 0:
+                break
+            preso = riserva.preleva(item, left, location=loc)
+            spostato += preso
+            left -= preso
+        mano.aggiungi(item, spostato, t.get("a", ""))
+
+    for a in arrivi:
+        item = a["item"]
+        loc = str(a.get("location", "") or "").strip()
+        if str(a.get("stock", "mano")).lower() == "riserva":
+            if not loc:
+                inv = reserve_inventory(riserva, item)
+                loc = inv[0][0] if inv else LOCATION_INVENTORY_DEFAULT
+            riserva.aggiungi(item, try_int(a.get("qty", 0)), loc)
+        else:
+            mano.aggiungi(item, try_int(a.get("qty", 0)), loc)
+
+# ---------------- Simulazione ----------------
+def valuta_ordine(mano, riserva, righe):
+    """
+    Logica di "Verifica ordine" (usata anche dalla simulazione): in mano basta la location
+    principale, altrimenti il mancante si cerca nelle location INVENTORY della riserva.
+    Restituisce (esito, pending_allocations) nel formato di st.session_state["pending_picks"];
+    ogni allocazione riporta anche 'richiesta', 'disponibile_mano', 'location_mano' e 'mancante'.
+    """
+    allocazioni = []
+    esito = ESITO_MANO
+    for item, req_qta in righe.items():
+        locs_mano, q_mano = get_locations_and_total(mano, item)
+        info = {"richiesta": req_qta, "disponibile_mano": q_mano, "location_mano": locs_mano}
+        if q_mano >= req_qta:
+            allocazioni.append({"item": item, "from_mano": req_qta, "reserve_alloc": [], "mancante": 0, **info})
+            continue
+        left = req_qta - q_mano
+        allocs = []
+        for loc, q in reserve_inventory(riserva, item):
+            if left <= 0:
+                break
+            take = min(left, q)
+            if take > 0:
+                allocs.append({"location": loc, "qty": take})
+                left -= take
+        allocazioni.append({"item": item, "from_mano": q_mano, "reserve_alloc": allocs, "mancante": left, **info})
+        if left > 0:
+            esito = ESITO_SCOPERTO
+        elif esito == ESITO_MANO:
+            esito = ESITO_RISERVA
+    return esito, allocazioni
+
+def simula(stock_in_mano, stock_in_riserva, backlog, trasferimenti=(), arrivi=(), priorita="fifo"):
+    """
+    Evade in sequenza tutto il backlog su viste copy-on-write dello stock.
+    Solo gli ordini interamente coperti scalano lo stock (come un prelievo confermato);
+    gli ordini non coperti restano in attesa e non consumano nulla.
+    Restituisce {'metriche': {...}, 'ordini': [{...}]}.
+    """
+    mano = VistaStock(stock_in_mano)
+    riserva = VistaStock(stock_in_riserva)
+    applica_scenario(mano, riserva, trasferimenti, arrivi)
+
+    conteggi = {ESITO_MANO: 0, ESITO_RISERVA: 0, ESITO_SCOPERTO: 0}
+    righe_tot = righe_ok = qta_tot = qta_ok = 0
+    ordini = []
+    for o in ordina_backlog(backlog, priorita):
+        esito, allocazioni = valuta_ordine(mano, riserva, o["righe"])
+        conteggi[esito] += 1
+        righe_tot += len(o["righe"])
+        qta_tot += o["totale"]
+        if esito != ESITO_SCOPERTO:
+            righe_ok += len(o["righe"])
+            qta_ok += o["totale"]
+            applica_prelievi(mano, riserva, allocazioni)
+        ordini.append({
+            "Order Number": o["ordine"],
+            "Righe": len(o["righe"]),
+            "Quantità richiesta": o["totale"],
+            "Da riserva": sum(a["qty"] for p in allocazioni for a in p["reserve_alloc"]),
+            "Esito": esito,
+        })
+
+    n = len(ordini)
+    metriche = {
+        "ordini": n,
+        "coperti_mano": conteggi[ESITO_MANO],
+        "coperti_riserva": conteggi[ESITO_RISERVA],
+        "non_coperti": conteggi[ESITO_SCOPERTO],
+        "fill_rate_ordini": (conteggi[ESITO_MANO] + conteggi[ESITO_RISERVA]) / n if n else 0.0,
+        "fill_rate_righe": righe_ok / righe_tot if righe_tot else 0.0,
+        "fill_rate_quantita": qta_ok / qta_tot if qta_tot else 0.0,
+    }
+    return {"metriche": metriche, "ordini": ordini}